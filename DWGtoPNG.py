@@ -1,10 +1,19 @@
 import sys
 import os
 import subprocess
+import hashlib
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import ezdxf
+import numpy as np
+import cv2
+from PIL import Image
 import platform
 from ezdxf.addons.drawing import RenderContext, Frontend
 import time
@@ -27,38 +36,62 @@ def get_default_oda_path():
 # 2. Output Settings
 ODA_PATH = get_default_oda_path()
 # OUTPUT_DPI = 600  # Higher DPI = "High Res Screenshot"
+# Matplotlib never rasterizes above this; higher DPIs are upscaled from it
+MAX_RENDER_DPI = 200
 
-def convert_dwg_to_png(dwg_path, OUTPUT_DPI):
-    
+# One render Figure per process, reused across files; _get_render_axes restores
+# its default state before each file
+_render_fig = None
 
-    
-    base_dir = os.path.dirname(os.path.abspath(dwg_path))
-    filename = os.path.basename(dwg_path)
-    filename_no_ext = os.path.splitext(filename)[0]
-    
-    # Define Output Path (Same folder as input, same name, .png extension)
-    output_png_path = os.path.join(base_dir, f"{filename_no_ext}.png")
-    # output_png_path = output_path
-    
-    temp_dir = os.path.join(base_dir, "temp_render")
-    
-    # 1. CLEANUP & PREP
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
+def _init_worker():
+    """Per-process setup for batch workers (spawned processes start fresh)."""
+    matplotlib.use('Agg')
 
-    print(f"--- Processing: {dwg_path} ---")
 
-    # 2. CONVERT DWG -> DXF (Using ODA)
+def _get_render_axes():
+    """Returns this process's render Axes, reset to the default per-file state.
+
+    ax.clear() only resets the Axes, so the Figure-level state left by the
+    previous file (DPI, size in inches, facecolor) is restored here as well.
+    """
+    global _render_fig
+    if _render_fig is None:
+        # Plain Figure + Agg canvas: not registered with pyplot, so nothing leaks across a batch
+        _render_fig = Figure()
+        FigureCanvasAgg(_render_fig)
+        _render_fig.add_axes([0, 0, 1, 1])
+    # render_dxf_to_png leaves its output DPI on the figure, and ezdxf derives
+    # min_lineweight from figure.dpi, so start every file from the default DPI.
+    # ezdxf's finalize also sets the figure size and facecolor per drawing.
+    _render_fig.set_dpi(matplotlib.rcParams['figure.dpi'])
+    _render_fig.set_size_inches(matplotlib.rcParams['figure.figsize'])
+    _render_fig.set_facecolor(matplotlib.rcParams['figure.facecolor'])
+    ax = _render_fig.axes[0]
+    ax.clear()
+    return ax
+
+
+def bulk_dwg_to_dxf(source_folder, temp_dir, file_filter=None):
+    """Converts every DWG in source_folder to DXF in temp_dir with one ODA run.
+
+    file_filter narrows the run to matching files (e.g. a single filename).
+    Returns True if ODA exited cleanly.
+    """
+    # 1. CLEANUP & PREP (several ODA threads may get here at once)
+    os.makedirs(temp_dir, exist_ok=True)
+
     # We use ODA because Python cannot natively read DWG files reliably.
-    print("Step 1: Converting DWG to DXF (geometry extraction)...")
+    # ODA takes a whole input folder, so one launch covers every file in it.
     oda_cmd = [
         ODA_PATH,
-        base_dir,       # Input Folder
+        source_folder,  # Input Folder
         temp_dir,       # Output Folder
         "ACAD2010",     # Version 2010 is a sweet spot for compatibility
         "DXF",          # Type
         "0", "0"        # Recurse, Audit
     ]
+    if file_filter:
+        oda_cmd.append(file_filter)
 
     # 1. Initialize as None (Safe for Linux/Mac)
     startupinfo = None
@@ -69,34 +102,71 @@ def convert_dwg_to_png(dwg_path, OUTPUT_DPI):
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
             startupinfo.wShowWindow = subprocess.SW_HIDE
 
-        # 3. Run the command
+        # 3. Run the command (hidden window on Windows)
         # Passing 'startupinfo=None' on Linux is perfectly fine and safe.
-    subprocess.run(
+        # Output goes to DEVNULL, never a pipe, so ODA can't block on a full buffer.
+    proc = subprocess.Popen(
             oda_cmd, 
             stdout=subprocess.DEVNULL, 
             stderr=subprocess.DEVNULL,
             startupinfo=startupinfo
         )
+    returncode = proc.wait()
+
+    # Output is discarded, so the exit code is our only error signal
+    if returncode != 0:
+        print(f"❌ ODA exited with code {returncode}")
+        return False
+    return True
+
+
+def dwg_to_dxf(dwg_path, temp_dir):
+    """Converts a single DWG to DXF in temp_dir. Returns the DXF path or None."""
+    source_folder, filename = os.path.split(os.path.abspath(dwg_path))
+    dxf_path = os.path.join(temp_dir, f"{os.path.splitext(filename)[0]}.dxf")
+
+    # ODA can exit 0 without writing anything, so clear any DXF left by an earlier
+    # run; whatever exists afterwards was produced by this call.
+    if os.path.exists(dxf_path):
+        os.remove(dxf_path)
+    if not bulk_dwg_to_dxf(source_folder, temp_dir, file_filter=filename):
+        return None
 
-# 3. Run with the hidden flag
-    subprocess.run(
-        oda_cmd, 
-        capture_output=True, 
-        startupinfo=startupinfo  # <--- THIS IS THE KEY
-    )
-    
-    # Run ODA
-    
-    
     # Find the generated DXF
-    filename = os.path.splitext(os.path.basename(dwg_path))[0]
-    dxf_path = os.path.join(temp_dir, f"{filename}.dxf")
-    
     if not os.path.exists(dxf_path):
-        print("❌ CRITICAL: DXF file was not created. Check ODA path.")
-        return
+        return None
+    return dxf_path
+
+
+def _file_digest(path):
+    """Content hash of a file, read in 1 MB chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-    # 3. RENDER DXF -> PNG (The "Virtual Screenshot" Step)
+
+def cached_dwg_to_dxf(dwg_path, temp_dir, cache_dir):
+    """Like dwg_to_dxf, but reuses a previous conversion of identical DWG content."""
+    cached_dxf = os.path.join(cache_dir, f"{_file_digest(dwg_path)}.dxf")
+    if os.path.exists(cached_dxf):
+        return cached_dxf
+
+    # dwg_to_dxf only returns a DXF written by this run, never a stale one
+    dxf_path = dwg_to_dxf(dwg_path, temp_dir)
+    if dxf_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Copy then rename, so a concurrent lookup never sees a half-written entry
+        partial = f"{cached_dxf}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(dxf_path, partial)
+        os.replace(partial, cached_dxf)
+    return dxf_path
+
+
+def render_dxf_to_png(dxf_path, png_path, dpi):
+    """Renders the model space of a DXF file to a PNG. Returns png_path or None."""
+    # RENDER DXF -> PNG (The "Virtual Screenshot" Step)
     print("Step 2: Rendering geometry to Image (Matplotlib)...")
     
     try:
@@ -110,26 +180,62 @@ def convert_dwg_to_png(dwg_path, OUTPUT_DPI):
         ctx = RenderContext(doc)
         
         # Setup the Plot (The "Camera")
-        fig = plt.figure()
-        ax = fig.add_axes([0, 0, 1, 1])
-        ctx = RenderContext(doc)
+        # Reuse the process-wide Figure so Agg keeps its buffers between files
+        ax = _get_render_axes()
+        fig = ax.figure
         out = MatplotlibBackend(ax)
         
         # The Frontend orchestrates the drawing
         Frontend(ctx, out).draw_layout(msp, finalize=True)
         
         # Save the "Screenshot"
-        print(f"Saving high-res PNG to: {output_png_path}")
-        fig.savefig(output_png_path, dpi=OUTPUT_DPI)
-        
-        # Close the plot to free memory
-        plt.close(fig)
+        # Agg cost grows with DPI², so rasterize at no more than MAX_RENDER_DPI and
+        # upscale line art with Lanczos; then let Pillow encode with fast zlib (level 1).
+        print(f"Saving high-res PNG to: {png_path}")
+        render_dpi = min(dpi, MAX_RENDER_DPI)
+        fig.set_dpi(render_dpi)
+        fig.canvas.draw()
+        pixels = np.asarray(fig.canvas.buffer_rgba())
+        if render_dpi < dpi:
+            h, w = pixels.shape[:2]
+            size = (round(w * dpi / render_dpi), round(h * dpi / render_dpi))
+            pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_LANCZOS4)
+        Image.fromarray(pixels).save(png_path, format='PNG', compress_level=1)
         print("✅ Success! Conversion Complete.")
 
-        return output_png_path
+        return png_path
         
     except Exception as e:
         print(f"❌ Render Error: {e}")
+
+
+def convert_dwg_to_png(dwg_path, OUTPUT_DPI, output_png_path=None):
+    
+
+    
+    base_dir = os.path.dirname(os.path.abspath(dwg_path))
+    filename = os.path.basename(dwg_path)
+    filename_no_ext = os.path.splitext(filename)[0]
+    
+    # Define Output Path (Same folder as input, same name, .png extension)
+    if output_png_path is None:
+        output_png_path = os.path.join(base_dir, f"{filename_no_ext}.png")
+    # output_png_path = output_path
+    
+    temp_dir = os.path.join(base_dir, "temp_render")
+
+    print(f"--- Processing: {dwg_path} ---")
+
+    # 2. CONVERT DWG -> DXF (Using ODA)
+    print("Step 1: Converting DWG to DXF (geometry extraction)...")
+    dxf_path = dwg_to_dxf(dwg_path, temp_dir)
+    
+    if dxf_path is None:
+        print("❌ CRITICAL: DXF file was not created. Check ODA path.")
+        return
+
+    # 3. RENDER DXF -> PNG
+    return render_dxf_to_png(dxf_path, output_png_path, OUTPUT_DPI)
         
     # Optional: Cleanup temp DXF
     # import shutil
@@ -166,23 +272,38 @@ def batch_convert_folder(source_folder, output_folder, dpi=300):
     success_count = 0
     start_time = time.time()
 
-    for index, filename in enumerate(dwg_files):
-        # Construct full file paths
-        input_path = os.path.join(source_folder, filename)
-        
-        # We want the output filename to be "floorplan.png" inside the output folder
-        output_filename = os.path.splitext(filename)[0] + ".png"
-        output_path = os.path.join(output_folder, output_filename)
+    temp_dir = os.path.join(output_folder, "temp_render")
+    # DXFs keyed by DWG content hash, so unchanged drawings skip ODA on later runs
+    cache_dir = os.path.join(output_folder, ".dwg2png_cache")
+    workers = min(total_files, os.cpu_count() or 1)
+    # "spawn" because the Agg backend is not fork-safe on macOS.
+    ctx = multiprocessing.get_context("spawn")
 
-        print(f"[{index + 1}/{total_files}] Converting: {filename} ...")
+    # Two-stage pipeline: ODA runs are external processes, so threads are enough to
+    # keep several going; each finished DXF is handed straight to a render process.
+    with ThreadPoolExecutor(max_workers=min(total_files, 4)) as odas, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as renders:
+        oda_futures = {odas.submit(cached_dwg_to_dxf, os.path.join(source_folder, f), temp_dir, cache_dir): f for f in dwg_files}
 
-        # CALL THE IMPORTER
-        result = convert_dwg_to_png(input_path, output_path,dpi)
-        
-        if result:
-            success_count += 1
-        else:
-            print(f"   ⚠️ Failed to convert: {filename}")
+        render_futures = {}
+        for future in as_completed(oda_futures):
+            filename = oda_futures[future]
+            dxf_path = future.result()
+            if dxf_path is None:
+                print(f"   ⚠️ Failed to convert: {filename} (no DXF produced)")
+                continue
+
+            # We want the output filename to be "floorplan.png" inside the output folder
+            output_path = os.path.join(output_folder, os.path.splitext(filename)[0] + ".png")
+            render_futures[renders.submit(render_dxf_to_png, dxf_path, output_path, dpi)] = filename
+
+        for index, future in enumerate(as_completed(render_futures)):
+            filename = render_futures[future]
+            print(f"[{index + 1}/{total_files}] Finished: {filename}")
+            if future.result():
+                success_count += 1
+            else:
+                print(f"   ⚠️ Failed to convert: {filename}")
 
     # 4. Final Report
     elapsed = time.time() - start_time
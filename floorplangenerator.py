@@ -1,12 +1,68 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 import numpy as np
 import random
 import json
 import math
 import cv2
-import io
 import os
+import gc
+import heapq
+import functools
+import itertools
+
+# Unit (cos, sin) for the door-leaf end angles used in add_doors
+_DOOR_DIR = {90: (0.0, 1.0), 180: (-1.0, 0.0), 270: (0.0, -1.0), 360: (1.0, 0.0)}
+
+# Neighbouring 5px buckets (own bucket first) probed by _add_wall
+_BUCKET_OFFSETS = list(itertools.product((0, -5, 5), repeat=4))
+
+# Closest Hershey face for each plan font family
+_FONT_FACES = {'sans-serif': cv2.FONT_HERSHEY_SIMPLEX, 'serif': cv2.FONT_HERSHEY_TRIPLEX, 'monospace': cv2.FONT_HERSHEY_PLAIN}
+
+def _bgr(hex_color):
+    """'#RRGGBB' or '#RGB' -> OpenCV BGR tuple."""
+    h = hex_color.lstrip('#')
+    if len(h) == 3: h = ''.join(c*2 for c in h)
+    r, g, b = (int(h[i:i+2], 16) for i in (0, 2, 4))
+    return (b, g, r)
+
+def _font_scale(face, size_pt, dpi):
+    """Hershey scale whose digit height matches a size_pt font at dpi (digits are ~0.72 em)."""
+    unit_h = cv2.getTextSize("0", face, 1.0, 1)[0][1]
+    return size_pt * dpi / 100 / unit_h
+
+@functools.lru_cache(maxsize=4096)
+def _format_mm(unit_mode, mm_val):
+    """Formats a length in mm for the given unit mode (memoized: plans repeat lengths a lot)."""
+    if unit_mode == 'mm':
+        return str(mm_val)
+    elif unit_mode == 'mm_suffix':
+        return f"{mm_val} mm"
+    elif unit_mode == 'm':
+        return f"{round(mm_val / 1000, 1)}m" # 4.5m
+    elif unit_mode == 'inch':
+        return f"{int(mm_val / 25.4)}\"" # 120"
+    elif unit_mode == 'ft':
+        total_inches = int(mm_val / 25.4)
+        ft = total_inches // 12
+        inch = total_inches % 12
+        return f"{ft}'{inch}\""
+    return str(mm_val)
+
+def _crosses(wall_arr, x1, y1, x2, y2, my_id):
+    """True if the dimension line (x1,y1)-(x2,y2) cuts through any wall but my_id.
+
+    wall_arr is an (N,5) array of x1, y1, x2, y2, id. _add_wall stores axis-aligned walls
+    with x1 <= x2 and y1 <= y2, so each column is already its own min/max.
+    """
+    wx1, wy1, wx2, wy2, ids = wall_arr.T
+    # Bounding-box overlap, evaluated for every wall at once
+    near = (min(x1,x2) <= wx2) & (max(x1,x2) >= wx1) & (min(y1,y2) <= wy2) & (max(y1,y2) >= wy1)
+    is_wall_horiz = (wy2 - wy1) < 5
+    if abs(y1-y2) < 1:
+        cross = ~is_wall_horiz & (min(x1,x2) < wx1) & (wx1 < max(x1,x2)) & (wy1 < y1) & (y1 < wy2)
+    else:
+        cross = is_wall_horiz & (min(y1,y2) < wy1) & (wy1 < max(y1,y2)) & (wx1 < x1) & (x1 < wx2)
+    return bool(np.any(near & cross & (ids != my_id)))
 
 class StyledPlanGenerator:
     def __init__(self, width=900, height=900, output_dir="dataset_styled"):
@@ -29,6 +85,9 @@ class StyledPlanGenerator:
         # Font Style
         self.font_family = random.choice(['sans-serif', 'serif', 'monospace'])
         self.font_size = random.randint(8, 11)
+        # Hershey face and scale that labels are drawn (and measured) with
+        self._face = _FONT_FACES[self.font_family]
+        self._text_scale = _font_scale(self._face, self.font_size, self.dpi)
         
         # Unit System (The "7.5", "mm", "inches" request)
         # Options: 'mm' (4500), 'm' (4.5), 'inch' (120"), 'ft' (10'6")
@@ -46,40 +105,116 @@ class StyledPlanGenerator:
         
         # Data
         self.walls = []      
+        self._wall_index = {}  # quantized coords -> wall, for O(1) shared-wall lookup
         self.windows = [] 
         self.dimensions = [] 
         self.rooms = [] 
         self.text_bboxes = [] 
+        # (N,5) int32 copy of wall coords + id for _crosses (see _refresh_wall_arrays)
+        self._wall_arr = np.empty((0, 5), dtype=np.int32)
         
         self.wall_id_counter = 100
         self.window_id_counter = 2000
         self.dim_id_counter = 1
         
-        self.fig = plt.figure(figsize=(width/self.dpi, height/self.dpi), dpi=self.dpi)
-        self.ax = self.fig.add_axes([0, 0, 1, 1])
-        self.ax.set_xlim(0, width)
-        self.ax.set_ylim(0, height)
-        self.ax.axis('off')
+        # Draw straight into a BGR buffer with OpenCV. Plan coords are y-up (see _pt);
+        # self.dpi only converts point sizes (line widths, fonts) to pixels.
+        self.img = np.full((height, width, 3), 255, np.uint8)
+
+    def _pt(self, x, y):
+        """Plan (y-up) coords -> integer image pixel (y-down)."""
+        return (int(round(x)), int(round(self.height - y)))
+
+    def _px(self, lw):
+        """Line width in points -> thickness in whole pixels."""
+        return max(1, int(round(lw * self.dpi / 72)))
+
+    def _rect(self, x, y, w, h, fill, edge=None):
+        p1, p2 = self._pt(x, y), self._pt(x + w, y + h)
+        cv2.rectangle(self.img, p1, p2, fill, -1)
+        if edge is not None: cv2.rectangle(self.img, p1, p2, edge, 1)
+
+    def _hatch_rect(self, x, y, w, h, color, spacing=6):
+        """'///' hatch: 45 degree lines clipped to the rectangle."""
+        (c0, r1), (c1, r0) = self._pt(x, y), self._pt(x + w, y + h)
+        c0, r0, c1, r1 = max(c0, 0), max(r0, 0), min(c1, self.width), min(r1, self.height)
+        if c1 <= c0 or r1 <= r0: return
+        # Draw on a copy: OpenCV can't draw into a strided slice in place
+        sub = self.img[r0:r1, c0:c1].copy()
+        sub[:] = 255
+        rh = r1 - r0
+        for k in range(-rh, c1 - c0, spacing):
+            cv2.line(sub, (k, rh), (k + rh, 0), color, 1, cv2.LINE_AA)
+        self.img[r0:r1, c0:c1] = sub
+
+    def _dashed_line(self, x1, y1, x2, y2, color, pattern=(6, 3, 1, 3)):
+        """Dash-dot line ('-.'); pattern alternates on/off run lengths in px."""
+        (c1, r1), (c2, r2) = self._pt(x1, y1), self._pt(x2, y2)
+        length = math.hypot(c2 - c1, r2 - r1)
+        if length == 0: return
+        ux, uy = (c2 - c1) / length, (r2 - r1) / length
+        t, i = 0.0, 0
+        while t < length:
+            run = pattern[i % len(pattern)]
+            if i % 2 == 0:
+                end = min(t + run, length)
+                cv2.line(self.img, (int(c1 + ux*t), int(r1 + uy*t)), (int(c1 + ux*end), int(r1 + uy*end)), color, 1)
+            t += run; i += 1
+
+    def _put_text(self, x, y, text, size_pt, color, face=None, bold=False, rotate=False, opaque=False):
+        """Draws text centered on plan point (x, y); rotate=True reads bottom-to-top."""
+        face = self._face if face is None else face
+        scale = _font_scale(face, size_pt, self.dpi)
+        thickness = 2 if bold else 1
+        (tw, th), base = cv2.getTextSize(text, face, scale, thickness)
+        pad = 2
+        patch = np.full((th + base + 2*pad, tw + 2*pad, 3), 255, np.uint8)
+        cv2.putText(patch, text, (pad, pad + th), face, scale, color, thickness, cv2.LINE_AA)
+        if rotate: patch = np.ascontiguousarray(np.rot90(patch))
+
+        ph, pw = patch.shape[:2]
+        cx, cy = self._pt(x, y)
+        r0, c0 = cy - ph // 2, cx - pw // 2
+        rr0, cc0 = max(r0, 0), max(c0, 0)
+        rr1, cc1 = min(r0 + ph, self.height), min(c0 + pw, self.width)
+        if rr1 <= rr0 or cc1 <= cc0: return
+        src = patch[rr0-r0:rr1-r0, cc0-c0:cc1-c0]
+        dst = self.img[rr0:rr1, cc0:cc1]
+        # Opaque labels get a white box; otherwise darken-blend (text is always darker than paper)
+        if opaque: dst[:] = src
+        else: np.minimum(dst, src, out=dst)
+
+    def _arrow_end(self, tip, other, style, color):
+        """Decorates the shaft end at tip: '>'/'<' open head, '|>'/'<|' filled, '|' bar."""
+        if not style: return
+        ux, uy = tip[0] - other[0], tip[1] - other[1]
+        norm = math.hypot(ux, uy)
+        if norm == 0: return
+        ux, uy = ux / norm, uy / norm
+        nx, ny = -uy, ux
+        if style == '|':
+            cv2.line(self.img, (int(tip[0] + 5*nx), int(tip[1] + 5*ny)), (int(tip[0] - 5*nx), int(tip[1] - 5*ny)), color, 1, cv2.LINE_AA)
+            return
+        bx, by = tip[0] - 7*ux, tip[1] - 7*uy
+        left, right = (int(bx + 3*nx), int(by + 3*ny)), (int(bx - 3*nx), int(by - 3*ny))
+        if '|' in style:
+            cv2.fillPoly(self.img, [np.array([tip, left, right], dtype=np.int32)], color, cv2.LINE_AA)
+        else:
+            cv2.line(self.img, tip, left, color, 1, cv2.LINE_AA)
+            cv2.line(self.img, tip, right, color, 1, cv2.LINE_AA)
+
+    def _draw_arrow(self, x1, y1, x2, y2, color):
+        """Dimension arrow from (x2, y2) to (x1, y1) in self.arrow_style (matplotlib syntax)."""
+        tail_style, head_style = self.arrow_style.split('-')
+        head, tail = self._pt(x1, y1), self._pt(x2, y2)
+        cv2.line(self.img, tail, head, color, 1, cv2.LINE_AA)
+        self._arrow_end(head, tail, head_style, color)
+        self._arrow_end(tail, head, tail_style, color)
 
     def _format_value(self, px_length):
         """Converts pixel length to the plan's specific unit string."""
         # Baseline: 10px = 100mm
-        mm_val = int(px_length * 10)
-        
-        if self.unit_mode == 'mm':
-            return str(mm_val)
-        elif self.unit_mode == 'mm_suffix':
-            return f"{mm_val} mm"
-        elif self.unit_mode == 'm':
-            return f"{round(mm_val / 1000, 1)}m" # 4.5m
-        elif self.unit_mode == 'inch':
-            return f"{int(mm_val / 25.4)}\"" # 120"
-        elif self.unit_mode == 'ft':
-            total_inches = int(mm_val / 25.4)
-            ft = total_inches // 12
-            inch = total_inches % 12
-            return f"{ft}'{inch}\""
-        return str(mm_val)
+        return _format_mm(self.unit_mode, int(px_length * 10))
 
     def generate_layout(self):
         margin = 150
@@ -91,9 +226,12 @@ class StyledPlanGenerator:
         # Only cull shapes if we have enough rooms (don't delete the only room!)
         if len(raw_rooms) > 3:
             center_x, center_y = self.width/2, self.height/2
-            raw_rooms.sort(key=lambda r: ((r[0]-center_x)**2 + (r[1]-center_y)**2), reverse=True)
+            # Farthest-from-center first; stable so ties keep split order like list.sort did
+            arr = np.asarray(raw_rooms, dtype=float)
+            d2 = (arr[:, 0]-center_x)**2 + (arr[:, 1]-center_y)**2
+            order = np.argsort(-d2, kind='stable')
             num_to_remove = random.randint(1, max(1, int(len(raw_rooms) * 0.4)))
-            self.rooms = raw_rooms[num_to_remove:]
+            self.rooms = [raw_rooms[i] for i in order[num_to_remove:]]
         else:
             self.rooms = raw_rooms
 
@@ -109,78 +247,109 @@ class StyledPlanGenerator:
             self._add_wall(x + w, y, x + w, y+h, room_cx, room_cy) 
             self._add_wall(x + w, y + h, x, y+h, room_cx, room_cy) 
             self._add_wall(x, y + h, x, y, room_cx, room_cy)       
+        self._refresh_wall_arrays()
+
+    def _refresh_wall_arrays(self):
+        self._wall_arr = np.array([[*w['coords'], w['id']] for w in self.walls], dtype=np.int32).reshape(-1, 5)
 
     def _recursive_split(self, rect, depth):
-        x, y, w, h = rect
-        # Stop if depth reached OR if room is too small
-        if depth == 0 or w < 160 or h < 160: return [rect]
-        
-        if w > h:
-            split = random.randint(int(w * 0.4), int(w * 0.6))
-            return self._recursive_split((x, y, split, h), depth-1) + self._recursive_split((x+split, y, w-split, h), depth-1)
-        else:
-            split = random.randint(int(h * 0.4), int(h * 0.6))
-            return self._recursive_split((x, y, w, split), depth-1) + self._recursive_split((x, y+split, w, h-split), depth-1)
+        # Iterative DFS: a LIFO stack visits (and draws random splits) in the same order
+        # the recursive version did, without building intermediate lists per level.
+        out, stack = [], [(rect, depth)]
+        while stack:
+            rect, depth = stack.pop()
+            x, y, w, h = rect
+            # Stop if depth reached OR if room is too small
+            if depth == 0 or w < 160 or h < 160:
+                out.append(rect)
+                continue
+            
+            if w > h:
+                split = random.randint(int(w * 0.4), int(w * 0.6))
+                first, second = (x, y, split, h), (x+split, y, w-split, h)
+            else:
+                split = random.randint(int(h * 0.4), int(h * 0.6))
+                first, second = (x, y, w, split), (x, y+split, w, h-split)
+            stack.append((second, depth-1))
+            stack.append((first, depth-1))
+        return out
 
     def _add_wall(self, x1, y1, x2, y2, rcx, rcy):
         if x1 > x2 or y1 > y2: x1, x2, y1, y2 = x2, x1, y2, y1
-        for w in self.walls:
+        # Bucket on a 5px grid. A wall within 5px on every coord can sit in a
+        # neighbouring bucket, so probe those too and apply the exact tolerance test;
+        # the earliest matching wall wins, as in the original linear scan.
+        key = (int(x1)//5*5, int(y1)//5*5, int(x2)//5*5, int(y2)//5*5)
+        existing = None
+        for offset in _BUCKET_OFFSETS:
+            w = self._wall_index.get(tuple(k + o for k, o in zip(key, offset)))
+            if w is None: continue
             wx1, wy1, wx2, wy2 = w['coords']
             if abs(wx1-x1)<5 and abs(wx2-x2)<5 and abs(wy1-y1)<5 and abs(wy2-y2)<5:
-                w['is_shared'] = True 
-                return 
-        self.walls.append({
+                if existing is None or w['id'] < existing['id']: existing = w
+        if existing is not None:
+            existing['is_shared'] = True 
+            return 
+        new_wall = {
             "id": self.wall_id_counter, "coords": [int(x1), int(y1), int(x2), int(y2)], 
             "is_shared": False, "has_opening": False,
             "room_center": (rcx, rcy)
-        })
+        }
+        self.walls.append(new_wall)
+        self._wall_index[key] = new_wall
         self.wall_id_counter += 1
 
     def draw_structure(self):
         # --- 1. USE GLOBAL WALL STYLES ---
+        wall_bgr = _bgr(self.wall_color)
+        thick = self.wall_thickness * 2.5 # Fill proportional to thickness
+        # Fills first so the wall outlines end up on top (was zorder 1 vs 10)
+        if self.fill_style != 'empty':
+            for w in self.walls:
+                x1, y1, x2, y2 = w['coords']
+                is_horiz = abs(y1 - y2) < 5
+                if is_horiz: rect = (x1, y1-thick/2, x2-x1, thick)
+                else: rect = (x1-thick/2, y1, thick, y2-y1)
+                
+                if self.fill_style == 'solid_black': self._rect(*rect, wall_bgr)
+                elif self.fill_style == 'solid_grey': self._rect(*rect, _bgr('#808080'))
+                elif self.fill_style == 'hatch': self._hatch_rect(*rect, wall_bgr)
+
+        # Wall Outline
+        lw = self._px(self.wall_thickness)
         for w in self.walls:
             x1, y1, x2, y2 = w['coords']
-            is_horiz = abs(y1 - y2) < 5
-            
-            # Wall Outline
-            self.ax.plot([x1, x2], [y1, y2], color=self.wall_color, lw=self.wall_thickness, zorder=10)
-            
-            thick = self.wall_thickness * 2.5 # Fill proportional to thickness
-            if self.fill_style != 'empty':
-                if is_horiz: rect = patches.Rectangle((x1, y1-thick/2), x2-x1, thick, angle=0)
-                else: rect = patches.Rectangle((x1-thick/2, y1), thick, y2-y1, angle=0)
-                
-                if self.fill_style == 'solid_black': rect.set_facecolor(self.wall_color)
-                elif self.fill_style == 'solid_grey': rect.set_facecolor('#808080')
-                elif self.fill_style == 'hatch':
-                    rect.set_facecolor('white'); rect.set_hatch('///'); rect.set_edgecolor(self.wall_color); rect.set_linewidth(0)
-                rect.set_zorder(1)
-                self.ax.add_patch(rect)
+            cv2.line(self.img, self._pt(x1, y1), self._pt(x2, y2), wall_bgr, lw, cv2.LINE_AA)
 
     def add_grid_lines(self):
-        x_starts = sorted(list(set([w['coords'][0] for w in self.walls])))[::2][:3]
-        y_starts = sorted(list(set([w['coords'][1] for w in self.walls])))[::2][:3]
+        # Every other unique start, first three: only the 5 smallest are ever needed
+        x_starts = heapq.nsmallest(5, {w['coords'][0] for w in self.walls})[::2]
+        y_starts = heapq.nsmallest(5, {w['coords'][1] for w in self.walls})[::2]
         labels = ['A', 'B', 'C', '1', '2', '3']
-        for i, x in enumerate(x_starts):
-            self.ax.plot([x, x], [50, self.height-50], color='#A0A0A0', ls='-.', lw=0.5, zorder=0)
-            self.ax.text(x, self.height-30, labels[i%3], ha='center', va='center', fontsize=8, bbox=dict(boxstyle="circle,pad=0.3", fc="white", ec="black", lw=0.5))
-        for i, y in enumerate(y_starts):
-            self.ax.plot([50, self.width-50], [y, y], color='#A0A0A0', ls='-.', lw=0.5, zorder=0)
-            self.ax.text(30, y, labels[i%3+3], ha='center', va='center', fontsize=8, bbox=dict(boxstyle="circle,pad=0.3", fc="white", ec="black", lw=0.5))
+        grid_bgr = _bgr('#A0A0A0')
+        bubbles = [(x, self.height-30, labels[i%3]) for i, x in enumerate(x_starts)]
+        bubbles += [(30, y, labels[i%3+3]) for i, y in enumerate(y_starts)]
+        for x in x_starts:
+            self._dashed_line(x, 50, x, self.height-50, grid_bgr)
+        for y in y_starts:
+            self._dashed_line(50, y, self.width-50, y, grid_bgr)
+        # Circled axis labels
+        for (bx, by, label) in bubbles:
+            cv2.circle(self.img, self._pt(bx, by), 10, (255, 255, 255), -1, cv2.LINE_AA)
+            cv2.circle(self.img, self._pt(bx, by), 10, (0, 0, 0), 1, cv2.LINE_AA)
+            self._put_text(bx, by, label, 8, (0, 0, 0), face=cv2.FONT_HERSHEY_SIMPLEX)
 
     def add_room_labels_and_furniture(self):
         for room in self.rooms:
             x, y, w, h, label = room
             cx, cy = x + w/2, y + h/2
             # --- 3. USE GLOBAL FONT ---
-            self.ax.text(cx, cy, label, ha='center', va='center', fontsize=self.font_size, 
-                         family=self.font_family, fontweight='bold', color='#404040', zorder=5)
+            self._put_text(cx, cy, label, self.font_size, _bgr('#404040'), bold=True)
             
             # Format area using the global unit system
             area_w = self._format_value(w)
             area_h = self._format_value(h)
-            self.ax.text(cx, cy-15, f"{area_w} x {area_h}", ha='center', va='center', 
-                         fontsize=self.font_size-2, family=self.font_family, color='#404040', zorder=5)
+            self._put_text(cx, cy-15, f"{area_w} x {area_h}", self.font_size-2, _bgr('#404040'))
 
             if min(w, h) < 60: continue 
             # (Furniture drawing code same as before, omitted for brevity)
@@ -200,10 +369,10 @@ class StyledPlanGenerator:
                 win_len = random.choice(valid_sizes)
                 mid_x, mid_y = (x1+x2)/2, (y1+y2)/2
                 if is_horiz:
-                    self.ax.add_patch(patches.Rectangle((mid_x-win_len/2, mid_y-3), win_len, 6, lw=1, ec='#999', fc='white', zorder=11))
+                    self._rect(mid_x-win_len/2, mid_y-3, win_len, 6, (255, 255, 255), edge=_bgr('#999'))
                     win_coords = [mid_x-win_len/2, mid_y, mid_x+win_len/2, mid_y]
                 else:
-                    self.ax.add_patch(patches.Rectangle((mid_x-3, mid_y-win_len/2), 6, win_len, lw=1, ec='#999', fc='white', zorder=11))
+                    self._rect(mid_x-3, mid_y-win_len/2, 6, win_len, (255, 255, 255), edge=_bgr('#999'))
                     win_coords = [mid_x, mid_y-win_len/2, mid_x, mid_y+win_len/2]
                 w['has_opening'] = True
                 self.windows.append({"id": self.window_id_counter, "wall_id": w['id'], "coords": [int(c) for c in win_coords], "length": int(win_len)})
@@ -228,35 +397,27 @@ class StyledPlanGenerator:
             if not target_wall: continue
             wx1, wy1, wx2, wy2 = target_wall['coords']
             # Draw door using self.wall_color
+            wall_bgr = _bgr(self.wall_color)
+            cut_lw = self._px(self.wall_thickness+1)
             if wall_idx in [0, 2]: 
                  dx = random.randint(int(wx1)+5, int(wx2)-door_size-5); dy = wy1
-                 self.ax.plot([dx, dx+door_size], [dy, dy], color='white', lw=self.wall_thickness+1, zorder=11) # Cut
+                 cv2.line(self.img, self._pt(dx, dy), self._pt(dx+door_size, dy), (255, 255, 255), cut_lw) # Cut
                  swing_start = (dx, dy) if wall_idx == 2 else (dx+door_size, dy)
                  theta1, theta2 = (0, 90) if wall_idx == 2 else (180, 270)
-                 self.ax.add_patch(patches.Arc(swing_start, door_size*2, door_size*2, theta1=theta1, theta2=theta2, color=self.wall_color, lw=1, zorder=11))
-                 self.ax.plot([swing_start[0], swing_start[0] + (door_size * math.cos(math.radians(theta2)))], [swing_start[1], swing_start[1] + (door_size * math.sin(math.radians(theta2)))], color=self.wall_color, lw=1, zorder=11)
             else: 
                  dx = wx1; dy = random.randint(int(wy1)+5, int(wy2)-door_size-5)
-                 self.ax.plot([dx, dx], [dy, dy+door_size], color='white', lw=self.wall_thickness+1, zorder=11)
+                 cv2.line(self.img, self._pt(dx, dy), self._pt(dx, dy+door_size), (255, 255, 255), cut_lw)
                  swing_start = (dx, dy) if wall_idx == 1 else (dx, dy+door_size)
                  theta1, theta2 = (90, 180) if wall_idx == 1 else (270, 360)
-                 self.ax.add_patch(patches.Arc(swing_start, door_size*2, door_size*2, theta1=theta1, theta2=theta2, color=self.wall_color, lw=1, zorder=11))
-                 self.ax.plot([swing_start[0], swing_start[0] + (door_size * math.cos(math.radians(theta2)))], [swing_start[1], swing_start[1] + (door_size * math.sin(math.radians(theta2)))], color=self.wall_color, lw=1, zorder=11)
+            # Swing arc + leaf. Image y points down, so CCW plan angles become negative here.
+            cv2.ellipse(self.img, self._pt(*swing_start), (door_size, door_size), 0, -theta2, -theta1, wall_bgr, 1, cv2.LINE_AA)
+            leaf_end = (swing_start[0] + door_size * _DOOR_DIR[theta2][0], swing_start[1] + door_size * _DOOR_DIR[theta2][1])
+            cv2.line(self.img, self._pt(*swing_start), self._pt(*leaf_end), wall_bgr, 1, cv2.LINE_AA)
             target_wall['has_opening'] = True
 
     def _line_crosses_walls(self, p1, p2, my_wall_id):
         x1, y1 = p1; x2, y2 = p2
-        for w in self.walls:
-            if w['id'] == my_wall_id: continue 
-            wx1, wy1, wx2, wy2 = w['coords']
-            if min(x1,x2) > max(wx1,wx2) or max(x1,x2) < min(wx1,wx2): continue
-            if min(y1,y2) > max(wy1,wy2) or max(y1,y2) < min(wy1,wy2): continue
-            is_dim_horiz = abs(y1-y2) < 1; is_wall_horiz = abs(wy1-wy2) < 5
-            if is_dim_horiz and not is_wall_horiz:
-                if min(x1,x2) < wx1 < max(x1,x2) and min(wy1,wy2) < y1 < max(wy1,wy2): return True
-            elif not is_dim_horiz and is_wall_horiz:
-                if min(y1,y2) < wy1 < max(y1,y2) and min(wx1,wx2) < x1 < max(wx1,wx2): return True
-        return False
+        return _crosses(self._wall_arr, x1, y1, x2, y2, my_wall_id)
 
     def add_smart_dimensions(self):
         strategy = random.choice(['detailed', 'simple', 'mixed'])
@@ -321,36 +482,34 @@ class StyledPlanGenerator:
 
         mid_x, mid_y = (x1 + x2) / 2, (y1 + y2) / 2
         is_vert = abs(x1 - x2) < 1
-        rotation = 90 if is_vert else 0
-        char_w, char_h = 8, 10
-        text_len_px = len(text_val) * char_w
+        # Measure the actual label with the face/scale _put_text draws it in
+        (text_len_px, char_h), _ = cv2.getTextSize(text_val, self._face, self._text_scale, 1)
         if is_vert: sim_bbox = [mid_x-char_h/2, mid_y-text_len_px/2, mid_x+char_h/2, mid_y+text_len_px/2]
         else: sim_bbox = [mid_x-text_len_px/2, mid_y-char_h/2, mid_x+text_len_px/2, mid_y+char_h/2]
         if self._check_collision(sim_bbox): return 
 
         # --- 2. USE GLOBAL ARROW STYLE ---
-        self.ax.annotate("", xy=(x1, y1), xytext=(x2, y2), arrowprops=dict(arrowstyle=self.arrow_style, lw=0.7, color=self.dim_color), zorder=12)
+        dim_bgr = _bgr(self.dim_color)
+        self._draw_arrow(x1, y1, x2, y2, dim_bgr)
         
         pos_mode = random.choices(['inline', 'above', 'below'], weights=[0.4, 0.3, 0.3])[0]
         shift = 9
-        bg_alpha = 0.0
-        if pos_mode == 'inline': tx, ty = mid_x, mid_y; bg_alpha = 1.0 
+        opaque = False
+        if pos_mode == 'inline': tx, ty = mid_x, mid_y; opaque = True 
         elif pos_mode == 'above': tx = mid_x - shift if is_vert else mid_x; ty = mid_y if is_vert else mid_y + shift
         else: tx = mid_x + shift if is_vert else mid_x; ty = mid_y if is_vert else mid_y - shift
 
         # --- 3. USE GLOBAL FONT ---
-        t = self.ax.text(tx, ty, text_val, rotation=rotation, ha='center', va='center',
-            fontsize=self.font_size, family=self.font_family, color=self.dim_color,
-            bbox=dict(facecolor='white', edgecolor='none', alpha=bg_alpha, pad=1), zorder=13)
-
-        self.fig.canvas.draw()
-        renderer = self.fig.canvas.get_renderer()
-        bbox = t.get_window_extent(renderer)
-        self.text_bboxes.append([bbox.x0, bbox.y0, bbox.x1, bbox.y1])
+        self._put_text(tx, ty, text_val, self.font_size, dim_bgr, rotate=is_vert, opaque=opaque)
+
+        # Record the simulated bbox moved to the text anchor (plan coords are pixels)
+        dx, dy = tx - mid_x, ty - mid_y
+        bx0, by0, bx1, by1 = sim_bbox[0]+dx, sim_bbox[1]+dy, sim_bbox[2]+dx, sim_bbox[3]+dy
+        self.text_bboxes.append([bx0, by0, bx1, by1])
         
         dim_entry = {
             "id": self.dim_id_counter, "val": text_val, "position": pos_mode,
-            "bbox": [int(bbox.x0), int(self.height - bbox.y1), int(bbox.x1), int(self.height - bbox.y0)],
+            "bbox": [int(bx0), int(self.height - by1), int(bx1), int(self.height - by0)],
             "dim_line": [int(x1), int(y1), int(x2), int(y2)]
         }
         dim_entry[link_type] = link_id
@@ -366,21 +525,23 @@ class StyledPlanGenerator:
         self.add_doors()      
         self.add_smart_dimensions()
         
-        buf = io.BytesIO()
-        self.fig.savefig(buf, format="png", bbox_inches='tight', pad_inches=0)
-        buf.seek(0)
-        img = cv2.imdecode(np.frombuffer(buf.getvalue(), dtype=np.uint8), 1)
-        
         img_path = os.path.join(self.img_dir, f"{filename}.jpg")
-        cv2.imwrite(img_path, img, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+        cv2.imwrite(img_path, self.img, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
         
         output_data = {"image_file": f"{filename}.jpg", "walls": self.walls, "windows": self.windows, "dimensions": self.dimensions}
         with open(os.path.join(self.json_dir, f"{filename}.json"), "w") as f:
             json.dump(output_data, f, indent=2)
-        plt.close(self.fig)
         return f"Created {filename}"
 
+    def close(self):
+        """Drops the image buffer and the plan data so they can be collected."""
+        del self.img, self.walls, self._wall_index, self.windows, self.dimensions, self.text_bboxes
+
 if __name__ == "__main__":
     for i in range(10):
         gen = StyledPlanGenerator(width=900, height=900)
         print(gen.generate(f"styled_plan_{i}"))
+        # Release this plan's buffers now instead of waiting for the GC thresholds
+        gen.close()
+        del gen
+        gc.collect()